@@ -1,11 +1,14 @@
 import google.generativeai as genai
-import json
-import re
 from config import GEMINI_API_KEY
-from utils import DateUtils, CategoryUtils
+from utils import AmountUtils, DateUtils, CategoryUtils, TextUtils, LRUCache, DEFAULT_CATEGORIES
+
+PARSE_CACHE_SIZE = 1024
 
 class AIProcessor:
     def __init__(self, sheets_manager=None):
+        # LRU of successful Gemini parses, keyed by normalized text, user and message day
+        self._parse_cache = LRUCache(PARSE_CACHE_SIZE)
+        
         if not GEMINI_API_KEY:
             print("❌ GEMINI_API_KEY not found!")
             return
@@ -21,15 +24,24 @@ class AIProcessor:
             return self.sheets_manager.get_categories()
         else:
             # Fallback if no sheets manager available
-            return ['Food & Dining', 'Transportation', 'Shopping & Retail', 'Utilities & Bills',
-                    'Health & Medical', 'Entertainment & Recreation', 'Education & Learning',
-                    'Personal Care & Beauty', 'Housing & Rent', 'Others']
+            return DEFAULT_CATEGORIES
 
+    def _cache_key(self, text, message_date, user_name):
+        """Relative dates ("kemarin") depend on the day, so it is part of the key"""
+        day = message_date.strftime('%Y-%m-%d') if message_date else None
+        return (' '.join(text.lower().split()), user_name, day)
+    
     def parse_expense_text(self, text, message_date=None, user_name=None):
         """Parse expense text with dynamic categories"""
         if not hasattr(self, 'model'):
             return {'error': 'Gemini API not initialized'}
 
+        cache_key = self._cache_key(text, message_date, user_name)
+        cached = self._parse_cache.get(cache_key)
+        if cached is not None:
+            print("✅ Parse cache hit")
+            return cached
+
         try:
             # Get current categories from sheet
             available_categories = self._get_available_categories()
@@ -75,9 +87,8 @@ Examples:
             response = self.model.generate_content(prompt)
             
             # Parse JSON from response
-            json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
-            if json_match:
-                expense_data = json.loads(json_match.group())
+            expense_data = TextUtils.extract_json_object(response.text)
+            if expense_data is not None:
                 
                 # Validate category against available categories
                 if expense_data.get('category') not in available_categories:
@@ -101,7 +112,8 @@ Examples:
                 expense_data['transaction_date'] = transaction_date
                 expense_data['input_by'] = user_name or 'Unknown'
                 
-                print(f"✅ Parsed expense with dynamic category: {expense_data}")
+                print(f"✅ Parsed expense with dynamic category: {expense_data.get('category')}")
+                self._parse_cache.put(cache_key, expense_data)
                 return expense_data
             else:
                 return self._fallback_parse(text, message_date, user_name)
@@ -131,35 +143,9 @@ Examples:
     
     def _fallback_parse(self, text, message_date, user_name):
         """Enhanced fallback with same date logic"""
-        import re
-        
-        # Extract amount using regex
-        amount_patterns = [
-            r'(\d+)(?:ribu|rb)',  # "4ribu" → 4000
-            r'(\d+)k',            # "20k" → 20000  
-            r'(\d+)(?:000)',      # "25000" → 25000
-            r'(\d+)'              # fallback to any number
-        ]
-        
-        amount = 0
-        for pattern in amount_patterns:
-            match = re.search(pattern, text.lower())
-            if match:
-                num = int(match.group(1))
-                if 'ribu' in text.lower() or 'rb' in text.lower():
-                    amount = num * 1000
-                elif 'k' in text.lower():
-                    amount = num * 1000
-                else:
-                    amount = num
-                break
-        
-        # Category detection
-        category = 'Other'
-        if any(word in text.lower() for word in ['makan', 'beli', 'food', 'goreng']):
-            category = 'Food'
-        elif any(word in text.lower() for word in ['bensin', 'grab', 'gojek']):
-            category = 'Transport'
+        text_lower = text.lower()
+        amount = AmountUtils.parse_simple_amount(text_lower)
+        category = CategoryUtils.simple_category(text_lower)
         
         # Use the same enhanced date logic
         transaction_date = self._determine_transaction_date(None, message_date, text)
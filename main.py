@@ -2,9 +2,10 @@ import logging
 import os
 import sys
 import threading
-import re
+import time
 import asyncio
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
@@ -12,7 +13,7 @@ from ai_processor import AIProcessor
 from vision_processor import VisionProcessor
 from sheets_manager import SheetsManager
 from config import TELEGRAM_BOT_TOKEN, WEBHOOK_SECRET
-from utils import ResponseFormatter
+from utils import AmountUtils, CategoryUtils, ResponseFormatter
 
 # Configure logging
 logging.basicConfig(
@@ -28,7 +29,7 @@ class ServiceState:
         self.ai_ready = False
         self.vision_ready = False
         self.bot_ready = False
-        self.initialization_start = datetime.now()
+        self.initialization_start = time.monotonic()
     
     def all_ready(self):
         return self.sheets_ready and self.ai_ready and self.vision_ready and self.bot_ready
@@ -40,7 +41,7 @@ class ServiceState:
             'ai': self.ai_ready,
             'vision': self.vision_ready,
             'bot': self.bot_ready,
-            'uptime': (datetime.now() - self.initialization_start).total_seconds()
+            'uptime': time.monotonic() - self.initialization_start
         }
 
 # Global instances
@@ -49,6 +50,34 @@ sheets_manager = None
 ai_processor = None
 vision_processor = None
 
+# Bounded pool for blocking Google API calls (Sheets, Gemini, Vision)
+blocking_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='google-api')
+
+async def run_blocking(func, *args):
+    """Run a blocking call in the shared executor without stalling the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, func, *args)
+
+# Backpressure: cap concurrent message processing and drop repeated submissions
+MAX_CONCURRENT_MESSAGES = 16
+DUPLICATE_WINDOW = 0.5  # seconds
+processing_slots = asyncio.Semaphore(MAX_CONCURRENT_MESSAGES)
+_last_seen = {}
+
+def _is_duplicate(chat_id, content_key):
+    """True if the same chat sent the same content within DUPLICATE_WINDOW"""
+    now = time.monotonic()
+    # Only entries inside the window can match, so the map stays as small as the active chats
+    for stale_chat in [chat for chat, (seen, _) in _last_seen.items() if now - seen >= DUPLICATE_WINDOW]:
+        del _last_seen[stale_chat]
+    last = _last_seen.get(chat_id)
+    _last_seen[chat_id] = (now, content_key)
+    return last is not None and last[1] == content_key and now - last[0] < DUPLICATE_WINDOW
+
+# Pending Sheets writes, flushed in batches by _expense_flush_worker
+EXPENSE_BATCH_SIZE = 20
+expense_queue = None
+expense_flush_task = None
+
 def initialize_services_background():
     """Initialize heavy services in background thread"""
     global sheets_manager, ai_processor, vision_processor, service_state
@@ -75,12 +104,91 @@ def initialize_services_background():
         logger.info("✅ Vision processor ready")
         
         service_state.bot_ready = True
-        init_time = (datetime.now() - service_state.initialization_start).total_seconds()
+        init_time = time.monotonic() - service_state.initialization_start
         logger.info(f"🚀 All services ready in {init_time:.2f}s")
         
     except Exception as e:
         logger.error(f"❌ Background initialization failed: {e}")
 
+async def _expense_flush_worker():
+    """Drain queued expenses and write them to Sheets in batches"""
+    while True:
+        batch = [await expense_queue.get()]
+        while len(batch) < EXPENSE_BATCH_SIZE and not expense_queue.empty():
+            batch.append(expense_queue.get_nowait())
+        
+        try:
+            expenses = [expense_data for expense_data, _ in batch]
+            success = await run_blocking(sheets_manager.add_expense_batch, expenses)
+        except Exception as e:
+            logger.error(f"❌ Batch write failed: {e}")
+            success = False
+        
+        for _, result in batch:
+            if not result.done():
+                result.set_result(success)
+
+async def save_expense(expense_data):
+    """Queue an expense for the batch writer and wait until it is written"""
+    if not sheets_manager or expense_queue is None:
+        return False
+    
+    result = asyncio.get_running_loop().create_future()
+    await expense_queue.put((expense_data, result))
+    return await result
+
+# Photos sent as one album are OCR'd together in a single Vision batch request
+ALBUM_COLLECT_SECONDS = 1.0
+_pending_albums = {}
+_album_tasks = set()  # strong refs, so pending flushes aren't garbage-collected
+
+def _schedule_album_flush(media_group_id):
+    """Start _flush_album as a task and hold a reference until it finishes"""
+    task = asyncio.create_task(_flush_album(media_group_id))
+    _album_tasks.add(task)
+    task.add_done_callback(_album_tasks.discard)
+
+async def extract_receipt(image_bytes, message_date, user_name, media_group_id=None):
+    """Run receipt extraction, batching photos that belong to the same album"""
+    if not media_group_id:
+        return await run_blocking(vision_processor.extract_receipt_data, image_bytes, message_date, user_name)
+    
+    loop = asyncio.get_running_loop()
+    result = loop.create_future()
+    album = _pending_albums.get(media_group_id)
+    if album is None:
+        album = _pending_albums[media_group_id] = []
+        loop.call_later(ALBUM_COLLECT_SECONDS, _schedule_album_flush, media_group_id)
+    album.append((image_bytes, message_date, user_name, result))
+    return await result
+
+async def _flush_album(media_group_id):
+    """Send every collected photo of an album to Vision in one batch"""
+    album = _pending_albums.pop(media_group_id, [])
+    try:
+        results = await run_blocking(
+            vision_processor.extract_receipt_data_batch,
+            [image_bytes for image_bytes, _, _, _ in album],
+            [message_date for _, message_date, _, _ in album],
+            [user_name for _, _, user_name, _ in album]
+        )
+    except Exception as e:
+        logger.error(f"❌ Album processing failed: {e}")
+        results = [{'error': str(e)} for _ in album]
+    
+    for index, (_, _, _, result) in enumerate(album):
+        # Never leave a photo waiting if the batch came back short
+        receipt_data = results[index] if index < len(results) else None
+        if not result.done():
+            result.set_result(receipt_data or {'error': 'No result for this photo in the album batch'})
+
+async def post_init(application: Application):
+    """Start background tasks once the bot's event loop is running"""
+    global expense_queue, expense_flush_task
+    expense_queue = asyncio.Queue()
+    expense_flush_task = asyncio.create_task(_expense_flush_worker())
+    logger.info("✅ Expense batch writer started")
+
 # Service-ready command handlers
 async def handle_start_with_check(update: Update, context: CallbackContext):
     """Start command with service readiness check"""
@@ -92,7 +200,7 @@ async def handle_start_with_check(update: Update, context: CallbackContext):
     logger.info(f"User @{username} (ID: {chat_id}) sent: /start")
     
     if not service_state.all_ready():
-        elapsed = (datetime.now() - service_state.initialization_start).total_seconds()
+        elapsed = time.monotonic() - service_state.initialization_start
         await update.message.reply_text(
             "🔄 **Bot is starting up...**\n"
             f"⏱️ Elapsed: {elapsed:.0f}s\n"
@@ -118,7 +226,12 @@ async def handle_text_with_check(update: Update, context: CallbackContext):
         )
         return
     
-    await handle_text(update, context)
+    if _is_duplicate(update.effective_chat.id, update.message.text):
+        logger.info(f"Ignoring duplicate text from chat {update.effective_chat.id}")
+        return
+    
+    async with processing_slots:
+        await handle_text(update, context)
 
 async def handle_photo_with_check(update: Update, context: CallbackContext):
     """Photo handler with vision service check"""
@@ -130,7 +243,12 @@ async def handle_photo_with_check(update: Update, context: CallbackContext):
         )
         return
     
-    await handle_photo(update, context)
+    if _is_duplicate(update.effective_chat.id, update.message.photo[-1].file_unique_id):
+        logger.info(f"Ignoring duplicate photo from chat {update.effective_chat.id}")
+        return
+    
+    async with processing_slots:
+        await handle_photo(update, context)
 
 async def handle_summary_with_check(update: Update, context: CallbackContext):
     """Summary with sheets check"""
@@ -155,8 +273,7 @@ async def handle_categories_with_check(update: Update, context: CallbackContext)
     await categories_command(update, context)
 
 # Command handlers
-async def start(update: Update, context: CallbackContext):
-    welcome_message = """
+WELCOME_MESSAGE = """
 🤖 **Selamat datang di Finance Tracker Bot!**
 
 📝 **Cara menggunakan:**
@@ -172,10 +289,8 @@ async def start(update: Update, context: CallbackContext):
 
 Mulai catat pengeluaran Anda! 💰
     """
-    await update.message.reply_text(welcome_message, parse_mode='Markdown')
 
-async def help_command(update: Update, context: CallbackContext):
-    help_text = """
+HELP_TEXT = """
 🔧 **Bantuan Finance Tracker Bot**
 
 **Format teks yang didukung:**
@@ -191,11 +306,16 @@ async def help_command(update: Update, context: CallbackContext):
 
 **Foto struk:** Kirim foto receipt untuk parsing otomatis dengan AI
     """
-    await update.message.reply_text(help_text, parse_mode='Markdown')
+
+async def start(update: Update, context: CallbackContext):
+    await update.message.reply_text(WELCOME_MESSAGE, parse_mode='Markdown')
+
+async def help_command(update: Update, context: CallbackContext):
+    await update.message.reply_text(HELP_TEXT, parse_mode='Markdown')
 
 async def summary_command(update: Update, context: CallbackContext):
     if sheets_manager:
-        summary = sheets_manager.get_monthly_summary()
+        summary = await run_blocking(sheets_manager.get_monthly_summary)
         await update.message.reply_text(summary, parse_mode='Markdown')
     else:
         await update.message.reply_text("❌ Sheets manager not available")
@@ -203,7 +323,7 @@ async def summary_command(update: Update, context: CallbackContext):
 async def categories_command(update: Update, context: CallbackContext):
     """Show available categories"""
     if sheets_manager:
-        categories = sheets_manager.get_categories()
+        categories = await run_blocking(sheets_manager.get_categories)
         category_list = "\n".join([f"• {cat}" for cat in categories])
         response = f"📋 **Available Categories:**\n{category_list}"
         await update.message.reply_text(response, parse_mode='Markdown')
@@ -228,7 +348,7 @@ async def system_warmup_command(update: Update, context: CallbackContext):
     # Test Sheets
     if sheets_manager:
         try:
-            categories = sheets_manager.get_categories()
+            categories = await run_blocking(sheets_manager.get_categories)
             test_results.append("✅ Sheets connected")
         except Exception as e:
             test_results.append(f"❌ Sheets failed: {str(e)[:50]}")
@@ -273,7 +393,7 @@ async def handle_text(update: Update, context: CallbackContext):
     try:
         # Parse with AI processor
         if ai_processor:
-            expense_data = ai_processor.parse_expense_text(user_text, message_date, user_name)
+            expense_data = await run_blocking(ai_processor.parse_expense_text, user_text, message_date, user_name)
         else:
             expense_data = {'error': 'AI processor not available'}
         
@@ -285,7 +405,7 @@ async def handle_text(update: Update, context: CallbackContext):
             expense_data['source'] = 'Gemini AI'
         
         # Save to Google Sheets
-        success = sheets_manager.add_expense(expense_data) if sheets_manager else False
+        success = await save_expense(expense_data)
         
         if success:
             response = ResponseFormatter.format_expense_confirmation(expense_data)
@@ -305,32 +425,26 @@ async def handle_photo(update: Update, context: CallbackContext):
     processing_msg = await update.message.reply_text("📷 Analyzing receipt with Google Vision AI...")
     
     try:
-        # Download photo
+        # Download photo straight into memory
         photo_file = await update.message.photo[-1].get_file()
-        photo_path = "temp_receipt.jpg"
-        await photo_file.download_to_drive(photo_path)
+        image_bytes = bytes(await photo_file.download_as_bytearray())
         
-        logger.info(f"📸 Photo downloaded: {photo_path}")
+        logger.info(f"📸 Photo downloaded: {len(image_bytes)} bytes")
         
         # Process with Vision API
         if vision_processor:
-            receipt_data = vision_processor.extract_receipt_data(photo_path, message_date, user_name)
+            receipt_data = await extract_receipt(image_bytes, message_date, user_name, update.message.media_group_id)
         else:
             await processing_msg.edit_text("❌ Vision processor not available")
             return
         
-        # Clean up temp file
-        if os.path.exists(photo_path):
-            os.remove(photo_path)
-            logger.info("🧹 Temp photo file cleaned up")
-        
         # Handle errors
         if receipt_data.get('error'):
             await processing_msg.edit_text(f"❌ Receipt analysis failed: {receipt_data['error']}")
             return
         
         # Save to Google Sheets
-        success = sheets_manager.add_expense(receipt_data) if sheets_manager else False
+        success = await save_expense(receipt_data)
         
         if success:
             response = f"""
@@ -363,42 +477,13 @@ async def handle_photo(update: Update, context: CallbackContext):
     except Exception as e:
         logger.error(f"❌ Error processing receipt: {e}")
         
-        # Cleanup
-        if os.path.exists("temp_receipt.jpg"):
-            os.remove("temp_receipt.jpg")
-        
         await processing_msg.edit_text("❌ Failed to process receipt image")
 
 def _fallback_parse(text, message_date, user_name):
     """Simple regex-based expense parser as fallback"""
-    
-    # Extract amount
-    amount = 0
-    amount_patterns = [
-        r'(\d+)(?:ribu|rb)',  # "4ribu" → 4000
-        r'(\d+)k',            # "20k" → 20000  
-        r'(\d+)(?:000)',      # "25000" → 25000
-        r'(\d+)'              # fallback to any number
-    ]
-    
-    for pattern in amount_patterns:
-        match = re.search(pattern, text.lower())
-        if match:
-            num = int(match.group(1))
-            if 'ribu' in text.lower() or 'rb' in text.lower():
-                amount = num * 1000
-            elif 'k' in text.lower():
-                amount = num * 1000
-            else:
-                amount = num
-            break
-    
-    # Simple category detection
-    category = 'Other'
-    if any(word in text.lower() for word in ['makan', 'beli', 'food', 'goreng']):
-        category = 'Food'
-    elif any(word in text.lower() for word in ['bensin', 'grab', 'gojek']):
-        category = 'Transport'
+    text_lower = text.lower()
+    amount = AmountUtils.parse_simple_amount(text_lower)
+    category = CategoryUtils.simple_category(text_lower)
     
     return {
         'description': text[:50].capitalize(),
@@ -431,7 +516,13 @@ def main():
         logger.info(f"📍 Render URL: {render_url}")
 
         # Create application
-        application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+        application = (
+            Application.builder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .concurrent_updates(True)  # Let handlers overlap while waiting on Google APIs
+            .post_init(post_init)
+            .build()
+        )
 
         # Add all your existing handlers
         application.add_handler(CommandHandler("start", handle_start_with_check))
@@ -1,39 +1,124 @@
+import threading
+import time
 from datetime import datetime
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.http import build_http
+from googleapiclient.errors import HttpError
 from google.oauth2.service_account import Credentials
 from config import GOOGLE_SHEET_ID, GOOGLE_CREDENTIALS_FILE
+from utils import DEFAULT_CATEGORIES
+
+CATEGORIES_CACHE_TTL = 300  # seconds
+SUMMARY_FULL_RESCAN_INTERVAL = 600  # seconds; catches edits/deletes to older rows
+
+# googleapiclient retries 5xx/429/socket errors with exponential backoff. Only reads
+# use it: a retried append may already have been committed and would duplicate rows.
+# After repeated failures stop calling Sheets for a while instead of hammering it
+SHEETS_NUM_RETRIES = 3
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_OPEN_SECONDS = 30
+
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive.file'
+]
+
+# Credentials and service are shared by every SheetsManager instance.
+# httplib2 connections are not thread-safe, so each worker thread executes
+# requests through its own long-lived AuthorizedHttp (kept in _HTTP_LOCAL).
+_CREDENTIALS = None
+_SERVICE = None
+_HTTP_LOCAL = threading.local()
 
 class SheetsManager:
     def __init__(self):
         self.sheet_id = GOOGLE_SHEET_ID
+        self._id_lock = threading.Lock()
+        self._max_id = None
+        self._categories_cache = None
+        self._categories_ts = 0
+        self._summary_sheet_available = True
+        # Running totals for the fallback scan: month, total, count, last row read, last full read
+        self._summary_lock = threading.Lock()
+        self._summary_state = None
+        self._permissions_checked = False
+        # Circuit breaker state, shared by every executor thread
+        self._circuit_lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._circuit_open_until = 0
         self.service = self._get_service()
         if self.service:
-            self.test_sheet_permissions()
+            self._max_id = self._load_max_id()
 
     def _get_service(self):
-        """Initialize Google Sheets service"""
+        """Initialize Google Sheets service, reusing the module-level one if built"""
+        global _CREDENTIALS, _SERVICE
+        if _SERVICE:
+            return _SERVICE
+
         try:
-            scopes = [
-                'https://www.googleapis.com/auth/spreadsheets',
-                'https://www.googleapis.com/auth/drive.file'
-            ]
-            credentials = Credentials.from_service_account_file(
-                GOOGLE_CREDENTIALS_FILE,
-                scopes=scopes
-            )
-            service = build('sheets', 'v4', credentials=credentials)
+            if _CREDENTIALS is None:
+                _CREDENTIALS = Credentials.from_service_account_file(
+                    GOOGLE_CREDENTIALS_FILE,
+                    scopes=SCOPES
+                )
+            _SERVICE = build('sheets', 'v4', credentials=_CREDENTIALS,
+                             static_discovery=True, cache_discovery=False)
             print("✅ Google Sheets service initialized")
-            return service
+            return _SERVICE
         except Exception as e:
             print(f"❌ Sheets service error: {e}")
             return None
 
+    def _thread_http(self):
+        """Authorized HTTP client for the calling thread, reused across requests"""
+        http = getattr(_HTTP_LOCAL, 'http', None)
+        if http is None:
+            # build_http applies googleapiclient's default socket timeout, like build() does
+            http = AuthorizedHttp(_CREDENTIALS, http=build_http())
+            _HTTP_LOCAL.http = http
+        return http
+
+    def _execute(self, request, num_retries=SHEETS_NUM_RETRIES):
+        """Execute an API request on this thread's pooled connection"""
+        with self._circuit_lock:
+            circuit_open = time.monotonic() < self._circuit_open_until
+        if circuit_open:
+            raise RuntimeError("Google Sheets temporarily unavailable, retrying shortly")
+
+        try:
+            result = request.execute(http=self._thread_http(), num_retries=num_retries)
+        except HttpError as e:
+            # 4xx (bad range, missing sheet, permissions) says nothing about Sheets health
+            if e.resp.status >= 500 or e.resp.status == 429:
+                self._record_failure()
+            raise
+        except Exception:
+            self._record_failure()
+            raise
+
+        with self._circuit_lock:
+            self._consecutive_failures = 0
+        return result
+
+    def _record_failure(self):
+        """Count a transient failure and open the circuit past the threshold"""
+        with self._circuit_lock:
+            self._consecutive_failures += 1
+            if self._consecutive_failures < CIRCUIT_FAILURE_THRESHOLD:
+                return
+            failures = self._consecutive_failures
+            self._circuit_open_until = time.monotonic() + CIRCUIT_OPEN_SECONDS
+            self._consecutive_failures = 0
+        print(f"⚠️ {failures} Sheets failures in a row, pausing for {CIRCUIT_OPEN_SECONDS}s")
+
     def test_sheet_permissions(self):
         """Test sheet access permissions"""
         try:
-            sheet_metadata = self.service.spreadsheets().get(
+            sheet_metadata = self._execute(self.service.spreadsheets().get(
                 spreadsheetId=self.sheet_id
-            ).execute()
+            ))
             title = sheet_metadata.get('properties', {}).get('title', 'Unknown')
             print(f"✅ Sheet access successful: {title}")
             return True
@@ -41,77 +126,110 @@ class SheetsManager:
             print(f"❌ Sheet permissions test failed: {e}")
             return False
 
-    def _get_next_id(self):
-        """Generate next incremental ID"""
-        if not self.service:
-            return 1
+    def _batch_read(self, ranges, **kwargs):
+        """Read several ranges in one batchGet call, returning {range: values}"""
+        result = self._execute(self.service.spreadsheets().values().batchGet(
+            spreadsheetId=self.sheet_id,
+            ranges=ranges,
+            **kwargs
+        ))
+        # valueRanges come back in request order, with normalized range names
+        value_ranges = result.get('valueRanges', [])
+        return {
+            requested: value_range.get('values', [])
+            for requested, value_range in zip(ranges, value_ranges)
+        }
+
+    @staticmethod
+    def _max_id_from_rows(rows):
+        """Highest numeric ID in an ID column read (header row skipped)"""
+        max_id = 0
+        for row in rows[1:]:  # Skip header row
+            if row and len(row) > 0:
+                try:
+                    current_id = int(row[0])
+                    max_id = max(max_id, current_id)
+                except (ValueError, TypeError):
+                    continue
+        return max_id
 
+    def _load_max_id(self):
+        """Read the highest existing ID from the sheet (one full A:A fetch)"""
         try:
             # Get all existing data to find the highest ID
-            result = self.service.spreadsheets().values().get(
+            result = self._execute(self.service.spreadsheets().values().get(
                 spreadsheetId=self.sheet_id,
                 range='Catatan!A:A'  # Only get ID column
-            ).execute()
+            ))
             
-            rows = result.get('values', [])
-            
-            # If no data or only headers, start with ID 1
-            if len(rows) <= 1:
-                return 1
-            
-            # Find the highest existing ID
-            max_id = 0
-            for row in rows[1:]:  # Skip header row
-                if row and len(row) > 0:
-                    try:
-                        current_id = int(row[0])
-                        max_id = max(max_id, current_id)
-                    except (ValueError, TypeError):
-                        continue
-            
-            return max_id + 1
+            return self._max_id_from_rows(result.get('values', []))
             
         except Exception as e:
             print(f"❌ Error getting next ID: {e}")
+            return None
+
+    def _get_next_id(self):
+        """Generate next incremental ID from the in-memory counter"""
+        if not self.service:
             return 1
 
+        with self._id_lock:
+            if self._max_id is None:
+                max_id = self._load_max_id()
+                if max_id is None:
+                    return 1
+                self._max_id = max_id
+            self._max_id += 1
+            return self._max_id
+
     def add_expense(self, expense_data):
         """Add expense with new 7-column structure including ID"""
+        return self.add_expense_batch([expense_data])
+
+    def add_expense_batch(self, expenses):
+        """Add several expenses with a single append request"""
         if not self.service:
             print("❌ Google Sheets service not available")
             return False
 
         try:
-            # Generate incremental ID
-            next_id = self._get_next_id()
-            
             # Updated row structure: ID, Transaction Date, Description, Amount, Category, Location, Input By
-            row_data = [
-                next_id,  # ID (auto-incremented)
-                expense_data.get('transaction_date', datetime.now().strftime('%Y-%m-%d')),  # Transaction Date
-                expense_data.get('description', ''),  # Description
-                expense_data.get('amount', 0),  # Amount
-                expense_data.get('category', 'Other'),  # Category
-                expense_data.get('location', 'Unknown'),  # Location/Merchant
-                expense_data.get('input_by', 'Unknown')  # Input By
-            ]
-
-            request_body = {'values': [row_data]}
-            print(f"🔄 Writing to sheet 'Catatan': {row_data}")
-
-            result = self.service.spreadsheets().values().append(
+            rows = []
+            for expense_data in expenses:
+                rows.append([
+                    self._get_next_id(),  # ID (auto-incremented)
+                    expense_data.get('transaction_date', datetime.now().strftime('%Y-%m-%d')),  # Transaction Date
+                    expense_data.get('description', ''),  # Description
+                    expense_data.get('amount', 0),  # Amount
+                    expense_data.get('category', 'Other'),  # Category
+                    expense_data.get('location', 'Unknown'),  # Location/Merchant
+                    expense_data.get('input_by', 'Unknown')  # Input By
+                ])
+
+            request_body = {'values': rows}
+            print(f"🔄 Writing {len(rows)} row(s) to sheet 'Catatan'")
+
+            result = self._execute(self.service.spreadsheets().values().append(
                 spreadsheetId=self.sheet_id,
                 range='Catatan!A:G',  # Updated range A=ID, B=Date, C=Description, D=Amount, E=Category, F=Location, G=InputBy
                 valueInputOption='RAW',
                 insertDataOption='INSERT_ROWS',
                 body=request_body
-            ).execute()
+            ), num_retries=0)  # Not idempotent: never resend a possibly-committed append
 
-            print(f"✅ Added expense to Catatan with ID {next_id}: {expense_data.get('description')}")
+            for row in rows:
+                print(f"✅ Added expense to Catatan with ID {row[0]}: {row[2]}")
             return True
 
         except Exception as e:
             print(f"❌ Error adding to sheet: {e}")
+            # Counter may be out of sync with the sheet now; re-read on next insert
+            with self._id_lock:
+                self._max_id = None
+            # Diagnose access problems once, instead of probing on every startup
+            if isinstance(e, HttpError) and e.resp.status == 403 and not self._permissions_checked:
+                self._permissions_checked = True
+                self.test_sheet_permissions()
             import traceback
             traceback.print_exc()
             return False
@@ -121,35 +239,97 @@ class SheetsManager:
         if not self.service:
             return "Google Sheets not available"
 
+        aggregates = self._get_summary_aggregates()
+        if aggregates is not None:
+            total_amount, count = aggregates
+            return f"📊 **Ringkasan Bulan Ini:**\n💰 Total: Rp {total_amount:,.0f}\n📝 Transaksi: {count}"
+
+        return self._scan_monthly_summary()
+
+    def _get_summary_aggregates(self):
+        """Read server-side monthly total and count from the Summary sheet
+
+        Expects Summary!A1 and Summary!A2 to hold:
+            =SUMPRODUCT((LEFT(Catatan!B2:B,7)=TEXT(TODAY(),"yyyy-mm"))*Catatan!D2:D)
+            =SUMPRODUCT(--(LEFT(Catatan!B2:B,7)=TEXT(TODAY(),"yyyy-mm")))
+        Returns None if the sheet or values are missing.
+        """
+        if not self._summary_sheet_available:
+            return None
+
         try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.sheet_id,
-                range='Catatan!A:G'  # Updated range for 7 columns
-            ).execute()
+            if self._max_id is None:
+                # ID counter is stale: refresh it in the same round-trip
+                values = self._batch_read(['Summary!A1:A2', 'Catatan!A:A'],
+                                          valueRenderOption='UNFORMATTED_VALUE')
+                with self._id_lock:
+                    if self._max_id is None:
+                        self._max_id = self._max_id_from_rows(values['Catatan!A:A'])
+                rows = values['Summary!A1:A2']
+            else:
+                result = self._execute(self.service.spreadsheets().values().get(
+                    spreadsheetId=self.sheet_id,
+                    range='Summary!A1:A2',
+                    valueRenderOption='UNFORMATTED_VALUE'
+                ))
+                rows = result.get('values', [])
 
-            rows = result.get('values', [])
+            if len(rows) < 2 or not rows[0] or not rows[1]:
+                return None
 
-            if len(rows) <= 1:
-                return "📊 **Ringkasan Bulan Ini:**\nBelum ada data pengeluaran"
+            return float(rows[0][0]), int(rows[1][0])
+
+        except HttpError as e:
+            # A missing Summary sheet/range won't fix itself; stop asking until restart
+            if e.resp.status in (400, 404):
+                print(f"⚠️ Summary sheet unavailable, scanning Catatan: {e}")
+                self._summary_sheet_available = False
+            else:
+                print(f"⚠️ Summary read failed, scanning Catatan this time: {e}")
+            return None
+        except Exception as e:
+            # Transient (network, open circuit, odd cell value): fall back for this call only
+            print(f"⚠️ Summary read failed, scanning Catatan this time: {e}")
+            return None
 
+    def _scan_monthly_summary(self):
+        """Compute the monthly summary from Catatan, reading only rows added since last time"""
+        try:
             current_month = datetime.now().strftime("%Y-%m")
-            total_amount = 0
-            count = 0
 
-            for row in rows[1:]:  # Skip headers
-                if len(row) >= 4:  # Need at least ID, Date, Description, Amount
+            with self._summary_lock:
+                state = self._summary_state
+                if (state is None or state['month'] != current_month or
+                        time.monotonic() - state['scanned_at'] > SUMMARY_FULL_RESCAN_INTERVAL):
+                    state = {'month': current_month, 'total': 0, 'count': 0,
+                             'last_row': 1, 'scanned_at': time.monotonic()}  # Row 1 is headers
+
+                # B=Transaction Date, C=Description, D=Amount
+                result = self._execute(self.service.spreadsheets().values().get(
+                    spreadsheetId=self.sheet_id,
+                    range=f"Catatan!B{state['last_row'] + 1}:D"
+                ))
+
+                rows = result.get('values', [])
+
+                # Filter on the date prefix first so only this month's amounts get parsed
+                month_amounts = [row[2] for row in rows
+                                 if len(row) >= 3 and row[0][:7] == current_month]
+
+                for amount in month_amounts:
                     try:
-                        # Transaction date is now in column B (index 1)
-                        transaction_date = row[1] if len(row) > 1 else ''
-                        # Amount is now in column D (index 3)
-                        amount = float(row[3]) if len(row) > 3 else 0
-                        
-                        if transaction_date.startswith(current_month):
-                            total_amount += amount
-                            count += 1
-                    except (ValueError, IndexError):
+                        state['total'] += float(amount)
+                        state['count'] += 1
+                    except ValueError:
                         continue
 
+                state['last_row'] += len(rows)
+                self._summary_state = state
+                total_amount, count = state['total'], state['count']
+
+            if state['last_row'] <= 1:
+                return "📊 **Ringkasan Bulan Ini:**\nBelum ada data pengeluaran"
+
             return f"📊 **Ringkasan Bulan Ini:**\n💰 Total: Rp {total_amount:,.0f}\n📝 Transaksi: {count}"
 
         except Exception as e:
@@ -162,10 +342,10 @@ class SheetsManager:
             return None
 
         try:
-            result = self.service.spreadsheets().values().get(
+            result = self._execute(self.service.spreadsheets().values().get(
                 spreadsheetId=self.sheet_id,
                 range='Catatan!A:G'
-            ).execute()
+            ))
 
             rows = result.get('values', [])
 
@@ -195,33 +375,33 @@ class SheetsManager:
         """Get available categories from m_category sheet"""
         if not self.service:
             # Fallback categories if sheet is unavailable
-            return ['Food & Dining', 'Transportation', 'Shopping & Retail', 'Utilities & Bills', 
-                    'Health & Medical', 'Entertainment & Recreation', 'Education & Learning',
-                    'Personal Care & Beauty', 'Housing & Rent', 'Others']
+            return DEFAULT_CATEGORIES
+        
+        if self._categories_cache and time.monotonic() - self._categories_ts < CATEGORIES_CACHE_TTL:
+            return self._categories_cache
         
         try:
-            result = self.service.spreadsheets().values().get(
+            result = self._execute(self.service.spreadsheets().values().get(
                 spreadsheetId=self.sheet_id,
                 range='m_category!A:A'
-            ).execute()
+            ))
             
             rows = result.get('values', [])
             
             if len(rows) <= 1:
+                # Cache the defaults too, so an empty sheet isn't re-read for every receipt
                 print("⚠️ No categories found in m_category sheet, using defaults")
-                return ['Food & Dining', 'Transportation', 'Shopping & Retail', 'Utilities & Bills',
-                        'Health & Medical', 'Entertainment & Recreation', 'Education & Learning', 
-                        'Personal Care & Beauty', 'Housing & Rent', 'Others']
-            
-            # Extract categories (skip header row)
-            categories = [row[0] for row in rows[1:] if row and len(row) > 0]
-            print(f"✅ Loaded {len(categories)} categories from m_category sheet")
+                categories = DEFAULT_CATEGORIES
+            else:
+                # Extract categories (skip header row)
+                categories = [row[0] for row in rows[1:] if row and len(row) > 0]
+                print(f"✅ Loaded {len(categories)} categories from m_category sheet")
+            self._categories_cache = categories
+            self._categories_ts = time.monotonic()
             return categories
             
         except Exception as e:
             print(f"❌ Error getting categories: {e}")
             # Return fallback categories
-            return ['Food & Dining', 'Transportation', 'Shopping & Retail', 'Utilities & Bills',
-                    'Health & Medical', 'Entertainment & Recreation', 'Education & Learning',
-                    'Personal Care & Beauty', 'Housing & Rent', 'Others']
+            return DEFAULT_CATEGORIES
 
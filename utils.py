@@ -1,7 +1,155 @@
+import json
 import re
+import threading
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
 from typing import Optional, Union, List
 
+try:
+    import ahocorasick
+except ImportError:  # Fall back to the regex/substring scans below
+    ahocorasick = None
+
+# Fallback categories when the m_category sheet is unavailable
+DEFAULT_CATEGORIES = ['Food & Dining', 'Transportation', 'Shopping & Retail', 'Utilities & Bills',
+                      'Health & Medical', 'Entertainment & Recreation', 'Education & Learning',
+                      'Personal Care & Beauty', 'Housing & Rent', 'Others']
+
+# Amount expressions as one alternation; _AMOUNT_PRIORITY ranks the named groups
+# so e.g. "25ribu" beats a bare number that appears earlier in the text
+_AMOUNT_RE = re.compile(
+    r'(?P<ribu>\d+)\s*(?:ribu|rb)'           # "25ribu" -> 25000
+    r'|(?P<k>\d+)\s*k(?:\s|$)'              # "25k" -> 25000
+    r'|(?P<juta>\d+)\s*(?:jt|juta)'          # "2jt" -> 2000000
+    r'|(?P<thousands>\d+(?:[.,]\d{3})+)'     # "25,000" -> 25000
+    r'|(?P<plain>\d+)'                       # "25000" -> 25000
+)
+_AMOUNT_PRIORITY = {'ribu': 0, 'k': 1, 'juta': 2, 'thousands': 3, 'plain': 4}
+
+# Thousands separators removed before int()/float() on "25.000"-style numbers
+THOUSANDS_SEP_TABLE = str.maketrans('', '', '.,')
+
+# Simple fallback parser used when Gemini is unavailable (main.py and AIProcessor).
+# Single pass over the text; the named group of each match gives the multiplier
+_SIMPLE_AMOUNT_RE = re.compile(r'(?P<ribu>\d+)\s*(?:ribu|rb)|(?P<k>\d+)\s*k\b|(?P<plain>\d+)')
+_SIMPLE_FOOD_RE = re.compile(r'makan|beli|food|goreng')
+_SIMPLE_TRANSPORT_RE = re.compile(r'bensin|grab|gojek')
+
+_JSON_DECODER = json.JSONDecoder()
+
+# Characters stripped by ValidationUtils.sanitize_user_input
+_SANITIZE_TABLE = str.maketrans('', '', '<>"\';')
+
+# Common Indonesian location indicators
+_LOCATION_PATTERNS = [
+    re.compile(r'di\s+([^0-9]+?)(?:\s+\d|$)'),           # "di alfamart"
+    re.compile(r'ke\s+([^0-9]+?)(?:\s+\d|$)'),           # "ke salon"
+    re.compile(r'dari\s+([^0-9]+?)(?:\s+\d|$)'),         # "dari toko"
+    re.compile(r'@\s*([^0-9\s]+)'),                      # "@alfamart"
+]
+
+# Enhanced keyword mapping
+CATEGORY_KEYWORDS = {
+    'Food & Dining': [
+        'makan', 'food', 'nasi', 'ayam', 'sate', 'warteg', 'resto', 'cafe', 
+        'kfc', 'mcd', 'pizza', 'bakery', 'bread', 'cake', 'goreng', 'sop', 'bakso'
+    ],
+    'Transportation': [
+        'bensin', 'grab', 'gojek', 'ojek', 'bus', 'taxi', 'motor', 'mobil', 
+        'pertamina', 'shell', 'spbu', 'parkir', 'tol'
+    ],
+    'Shopping & Retail': [
+        'beli', 'belanja', 'shop', 'mall', 'alfamart', 'indomaret', 'toko',
+        'hypermart', 'carrefour', 'giant', 'supermarket'
+    ],
+    'Personal Care & Beauty': [
+        'salon', 'potong rambut', 'spa', 'massage', 'kosmetik', 'pijet',
+        'barbershop', 'facial', 'manicure', 'pedicure'
+    ],
+    'Utilities & Bills': [
+        'listrik', 'air', 'internet', 'pulsa', 'token', 'pln', 'telkom',
+        'indihome', 'wifi', 'bayar tagihan'
+    ],
+    'Health & Medical': [
+        'dokter', 'obat', 'sakit', 'rumah sakit', 'apotek', 'klinik',
+        'medical', 'hospital', 'periksa'
+    ],
+    'Entertainment & Recreation': [
+        'bioskop', 'film', 'game', 'nonton', 'karaoke', 'gym', 'fitness',
+        'cinema', 'netflix', 'spotify', 'main'
+    ]
+}
+
+# Relative date keywords and weekdays, in the priority order they are checked
+RELATIVE_DATE_KEYWORDS = {
+    'yesterday': ['kemarin', 'kmrn', 'yesterday'],
+    'today': ['hari ini', 'today', 'tadi', 'barusan'],
+    'tomorrow': ['besok', 'tomorrow'],
+    'day_before_yesterday': ['kemarin dulu', 'lusa kemarin']
+}
+
+WEEKDAY_KEYWORDS = {
+    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
+    'friday': 4, 'saturday': 5, 'sunday': 6,
+    'senin': 0, 'selasa': 1, 'rabu': 2, 'kamis': 3,
+    'jumat': 4, 'sabtu': 5, 'minggu': 6
+}
+
+# keyword -> (priority, period name or weekday number); lowest priority wins
+_DATE_KEYWORD_RANKS = {}
+for _rank, (_period, _keywords) in enumerate(RELATIVE_DATE_KEYWORDS.items()):
+    for _keyword in _keywords:
+        _DATE_KEYWORD_RANKS.setdefault(_keyword, (_rank, _period))
+for _rank, (_day_name, _weekday) in enumerate(WEEKDAY_KEYWORDS.items(), start=len(RELATIVE_DATE_KEYWORDS)):
+    _DATE_KEYWORD_RANKS[_day_name] = (_rank, _weekday)
+
+def build_keyword_automaton(keyword_values):
+    """Aho-Corasick automaton yielding (keyword, value) for every keyword occurrence"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for keyword, value in keyword_values.items():
+        automaton.add_word(keyword, (keyword, value))
+    automaton.make_automaton()
+    return automaton
+
+_DATE_AUTOMATON = build_keyword_automaton(_DATE_KEYWORD_RANKS)
+_CATEGORY_AUTOMATON = build_keyword_automaton({
+    keyword: category
+    for category, keywords in CATEGORY_KEYWORDS.items()
+    for keyword in keywords
+})
+
+# Without pyahocorasick: one pattern per category. The lookahead lets matches overlap, so each
+# keyword found anywhere in the text is seen, like a substring test would.
+_CATEGORY_PATTERNS = {
+    category: re.compile('(?=(' + '|'.join(map(re.escape, keywords)) + '))')
+    for category, keywords in CATEGORY_KEYWORDS.items()
+}
+
+class LRUCache:
+    """Small thread-safe LRU cache of dict results; stores and returns copies"""
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key) -> Optional[dict]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                return None
+            self._entries.move_to_end(key)
+            return dict(value)
+    
+    def put(self, key, value: dict):
+        with self._lock:
+            self._entries[key] = dict(value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
 class DateUtils:
     """Indonesian date processing utilities"""
     
@@ -17,43 +165,32 @@ class DateUtils:
             
         text_lower = text.lower().strip()
         
-        # Relative date patterns
-        relative_patterns = {
-            'yesterday': ['kemarin', 'kmrn', 'yesterday'],
-            'today': ['hari ini', 'today', 'tadi', 'barusan'],
-            'tomorrow': ['besok', 'tomorrow'],
-            'day_before_yesterday': ['kemarin dulu', 'lusa kemarin']
-        }
-        
-        # Check relative dates
-        for period, keywords in relative_patterns.items():
-            if any(word in text_lower for word in keywords):
-                if period == 'yesterday':
-                    return (reference_date - timedelta(days=1)).strftime('%Y-%m-%d')
-                elif period == 'today':
-                    return reference_date.strftime('%Y-%m-%d')
-                elif period == 'tomorrow':
-                    return (reference_date + timedelta(days=1)).strftime('%Y-%m-%d')
-                elif period == 'day_before_yesterday':
-                    return (reference_date - timedelta(days=2)).strftime('%Y-%m-%d')
+        # Find every date keyword in one pass, then apply the highest-priority one
+        if _DATE_AUTOMATON is not None:
+            found = {keyword for _, (keyword, _) in _DATE_AUTOMATON.iter(text_lower)}
+        else:
+            found = {keyword for keyword in _DATE_KEYWORD_RANKS if keyword in text_lower}
         
-        # Check day of week
-        weekdays = {
-            'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
-            'friday': 4, 'saturday': 5, 'sunday': 6,
-            'senin': 0, 'selasa': 1, 'rabu': 2, 'kamis': 3,
-            'jumat': 4, 'sabtu': 5, 'minggu': 6
-        }
-        
-        for day_name, target_weekday in weekdays.items():
-            if day_name in text_lower:
-                current_weekday = reference_date.weekday()
-                days_back = (current_weekday - target_weekday) % 7
-                if days_back == 0:
-                    return reference_date.strftime('%Y-%m-%d')
-                else:
-                    target_date = reference_date - timedelta(days=days_back)
-                    return target_date.strftime('%Y-%m-%d')
+        if found:
+            _, match = min(_DATE_KEYWORD_RANKS[keyword] for keyword in found)
+            
+            if match == 'yesterday':
+                return (reference_date - timedelta(days=1)).strftime('%Y-%m-%d')
+            elif match == 'today':
+                return reference_date.strftime('%Y-%m-%d')
+            elif match == 'tomorrow':
+                return (reference_date + timedelta(days=1)).strftime('%Y-%m-%d')
+            elif match == 'day_before_yesterday':
+                return (reference_date - timedelta(days=2)).strftime('%Y-%m-%d')
+            
+            # Day of week: most recent occurrence, today included
+            current_weekday = reference_date.weekday()
+            days_back = (current_weekday - match) % 7
+            if days_back == 0:
+                return reference_date.strftime('%Y-%m-%d')
+            else:
+                target_date = reference_date - timedelta(days=days_back)
+                return target_date.strftime('%Y-%m-%d')
         
         # Default to reference date
         return reference_date.strftime('%Y-%m-%d')
@@ -66,24 +203,40 @@ class AmountUtils:
         """Parse Indonesian amount expressions to numeric value"""
         text_lower = text.lower().strip()
         
-        # Amount patterns (in priority order)
-        patterns = [
-            (r'(\d+)\s*(?:ribu|rb)', lambda x: int(x) * 1000),    # "25ribu" -> 25000
-            (r'(\d+)\s*k(?:\s|$)', lambda x: int(x) * 1000),     # "25k" -> 25000  
-            (r'(\d+)\s*jt|juta', lambda x: int(x) * 1000000),    # "2jt" -> 2000000
-            (r'(\d+)(?:[.,]\d{3})*', lambda x: int(re.sub(r'[.,]', '', x))),  # "25,000" -> 25000
-            (r'(\d+)', lambda x: int(x))                          # "25000" -> 25000
-        ]
+        # Single scan; keep the first match of the highest-priority kind
+        best_match = None
+        best_priority = len(_AMOUNT_PRIORITY)
+        for match in _AMOUNT_RE.finditer(text_lower):
+            priority = _AMOUNT_PRIORITY[match.lastgroup]
+            if priority < best_priority:
+                best_match, best_priority = match, priority
+                if priority == 0:
+                    break
         
-        for pattern, converter in patterns:
-            match = re.search(pattern, text_lower)
-            if match:
-                try:
-                    return float(converter(match.group(1)))
-                except (ValueError, TypeError):
-                    continue
+        if not best_match:
+            return 0.0
         
-        return 0.0
+        kind = best_match.lastgroup
+        value = best_match.group(kind)
+        if kind in ('ribu', 'k'):
+            return float(int(value) * 1000)
+        elif kind == 'juta':
+            return float(int(value) * 1000000)
+        elif kind == 'thousands':
+            return float(int(value.translate(THOUSANDS_SEP_TABLE)))
+        return float(int(value))
+    
+    @staticmethod
+    def parse_simple_amount(text_lower: str) -> int:
+        """Fallback amount: first "ribu"/"k" amount wins, otherwise first plain number"""
+        amount = 0
+        for match in _SIMPLE_AMOUNT_RE.finditer(text_lower):
+            if match.lastgroup == 'plain':
+                if not amount:
+                    amount = int(match.group('plain'))
+                continue
+            return int(match.group(match.lastgroup)) * 1000
+        return amount
     
     @staticmethod
     def format_rupiah(amount: Union[int, float]) -> str:
@@ -121,21 +274,28 @@ class TextUtils:
     @staticmethod
     def extract_location_from_text(text: str) -> str:
         """Extract location/merchant from expense text"""
-        # Common Indonesian location indicators
-        location_patterns = [
-            r'di\s+([^0-9]+?)(?:\s+\d|$)',           # "di alfamart"
-            r'ke\s+([^0-9]+?)(?:\s+\d|$)',           # "ke salon"  
-            r'dari\s+([^0-9]+?)(?:\s+\d|$)',         # "dari toko"
-            r'@\s*([^0-9\s]+)',                      # "@alfamart"
-        ]
-        
-        for pattern in location_patterns:
-            match = re.search(pattern, text.lower())
+        text_lower = text.lower()
+        for pattern in _LOCATION_PATTERNS:
+            match = pattern.search(text_lower)
             if match:
                 location = match.group(1).strip()
                 return TextUtils.capitalize_properly(location)
         
         return "Unknown"
+    
+    @staticmethod
+    def extract_json_object(text: str) -> Optional[dict]:
+        """Decode the first JSON object embedded in text (e.g. an AI reply), or None"""
+        start = text.find('{')
+        while start != -1:
+            try:
+                value, _ = _JSON_DECODER.raw_decode(text, start)
+                if isinstance(value, dict):
+                    return value
+            except ValueError:
+                pass
+            start = text.find('{', start + 1)
+        return None
 
 class ValidationUtils:
     """Input validation utilities"""
@@ -165,7 +325,7 @@ class ValidationUtils:
             return ""
         
         # Remove potentially dangerous characters
-        sanitized = re.sub(r'[<>"\';]', '', text)
+        sanitized = text.translate(_SANITIZE_TABLE)
         
         # Limit length
         return sanitized[:500].strip()
@@ -178,51 +338,51 @@ class CategoryUtils:
         """Match category based on keywords in text and location"""
         combined_text = f"{text.lower()} {location.lower()}"
         
-        # Enhanced keyword mapping
-        category_keywords = {
-            'Food & Dining': [
-                'makan', 'food', 'nasi', 'ayam', 'sate', 'warteg', 'resto', 'cafe', 
-                'kfc', 'mcd', 'pizza', 'bakery', 'bread', 'cake', 'goreng', 'sop', 'bakso'
-            ],
-            'Transportation': [
-                'bensin', 'grab', 'gojek', 'ojek', 'bus', 'taxi', 'motor', 'mobil', 
-                'pertamina', 'shell', 'spbu', 'parkir', 'tol'
-            ],
-            'Shopping & Retail': [
-                'beli', 'belanja', 'shop', 'mall', 'alfamart', 'indomaret', 'toko',
-                'hypermart', 'carrefour', 'giant', 'supermarket'
-            ],
-            'Personal Care & Beauty': [
-                'salon', 'potong rambut', 'spa', 'massage', 'kosmetik', 'pijet',
-                'barbershop', 'facial', 'manicure', 'pedicure'
-            ],
-            'Utilities & Bills': [
-                'listrik', 'air', 'internet', 'pulsa', 'token', 'pln', 'telkom',
-                'indihome', 'wifi', 'bayar tagihan'
-            ],
-            'Health & Medical': [
-                'dokter', 'obat', 'sakit', 'rumah sakit', 'apotek', 'klinik',
-                'medical', 'hospital', 'periksa'
-            ],
-            'Entertainment & Recreation': [
-                'bioskop', 'film', 'game', 'nonton', 'karaoke', 'gym', 'fitness',
-                'cinema', 'netflix', 'spotify', 'main'
-            ]
-        }
+        # Score each category by the number of distinct keywords present
+        if _CATEGORY_AUTOMATON is not None:
+            found = {hit for _, hit in _CATEGORY_AUTOMATON.iter(combined_text)}
+            scores = {}
+            for _, category in found:
+                scores[category] = scores.get(category, 0) + 1
+        else:
+            scores = {
+                category: len({match.group(1) for match in pattern.finditer(combined_text)})
+                for category, pattern in _CATEGORY_PATTERNS.items()
+            }
         
-        # Score each category
         best_category = None
         best_score = 0
         
-        for category, keywords in category_keywords.items():
+        for category in CATEGORY_KEYWORDS:
             if category in available_categories:
-                score = sum(1 for keyword in keywords if keyword in combined_text)
+                score = scores.get(category, 0)
                 if score > best_score:
                     best_score = score
                     best_category = category
         
         # Return best match or default
         return best_category if best_category else (available_categories[-1] if available_categories else 'Others')
+    
+    @staticmethod
+    def simple_category(text_lower: str) -> str:
+        """Fallback category for the simple parser"""
+        if _SIMPLE_FOOD_RE.search(text_lower):
+            return 'Food'
+        elif _SIMPLE_TRANSPORT_RE.search(text_lower):
+            return 'Transport'
+        return 'Other'
+
+_CONFIRMATION_TEMPLATE = """✅ **Pengeluaran berhasil dicatat!**
+
+📝 **Detail:**
+• **Tanggal:** {transaction_date}
+• **Deskripsi:** {description}
+• **Jumlah:** {amount_rupiah}
+• **Lokasi:** {location}
+• **Kategori:** {category}
+• **Input oleh:** {input_by}
+
+💾 Data tersimpan di Google Sheets"""
 
 class ResponseFormatter:
     """Format bot responses consistently"""
@@ -230,17 +390,9 @@ class ResponseFormatter:
     @staticmethod
     def format_expense_confirmation(expense_data: dict) -> str:
         """Format expense confirmation message"""
-        return f"""✅ **Pengeluaran berhasil dicatat!**
-
-📝 **Detail:**
-• **Tanggal:** {expense_data.get('transaction_date', 'N/A')}
-• **Deskripsi:** {expense_data.get('description', 'N/A')}
-• **Jumlah:** {AmountUtils.format_rupiah(expense_data.get('amount', 0))}
-• **Lokasi:** {expense_data.get('location', 'N/A')}
-• **Kategori:** {expense_data.get('category', 'N/A')}
-• **Input oleh:** {expense_data.get('input_by', 'N/A')}
-
-💾 Data tersimpan di Google Sheets"""
+        fields = defaultdict(lambda: 'N/A', expense_data)
+        fields['amount_rupiah'] = AmountUtils.format_rupiah(expense_data.get('amount', 0))
+        return _CONFIRMATION_TEMPLATE.format_map(fields)
     
     @staticmethod
     def format_error_message(error: str, context: str = "") -> str:
@@ -1,24 +1,233 @@
 import os
-import json
+import hashlib
 import re
 from datetime import datetime
+from io import BytesIO
+from PIL import Image, ImageOps
+from google.api_core import exceptions as api_exceptions
+from google.api_core import retry as api_retry
 from google.cloud import vision
+from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcTransport
 from google.oauth2.service_account import Credentials
 import google.generativeai as genai
 from config import GOOGLE_CREDENTIALS_FILE, GEMINI_API_KEY
-from utils import AmountUtils
+from utils import (AmountUtils, CategoryUtils, TextUtils, LRUCache, DEFAULT_CATEGORIES,
+                   THOUSANDS_SEP_TABLE, build_keyword_automaton)
+
+# Synchronous batch_annotate_images accepts at most 16 images per request
+VISION_BATCH_SIZE = 16
+
+# Longer photo edges are downscaled before upload; OCR accuracy holds well below this
+MAX_IMAGE_EDGE = 1600
+JPEG_QUALITY = 85
+
+# Receipt parsing patterns, compiled once at import
+_NUMERIC_LINE_RE = re.compile(r'^[\d\s\-/:.,]+$')
+_NUMBER_RE = re.compile(r'\d{1,3}(?:[.,]\d{3})*')
+_TOTAL_LINE_RE = re.compile(r'total|jumlah')
+_HEADER_SKIP_RE = re.compile(r'receipt|struk|bon|total')
+_RECEIPT_DATE_RE = re.compile(r'\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})\b')
+
+# Chain stores whose printed receipts are regular enough to parse without Gemini
+KNOWN_RECEIPT_MERCHANTS = {
+    'indomaret': 'Indomaret',
+    'alfamart': 'Alfamart',
+    'alfamidi': 'Alfamidi',
+    'superindo': 'Superindo',
+    'hypermart': 'Hypermart',
+    'carrefour': 'Carrefour',
+    'lottemart': 'Lottemart',
+}
+
+# Fallback merchant keywords when no sheet is connected; earlier categories win ties
+MERCHANT_CATEGORY_KEYWORDS = {
+    'Food & Dining': [
+        'restaurant', 'resto', 'cafe', 'food', 'makan', 'warung',
+        'kfc', 'mcd', 'pizza', 'bakery', 'bread', 'cake', 'starbucks',
+        'dunkin', 'breadtalk', 'hokben', 'ayam', 'sate', 'nasi', 'warteg',
+        'padang', 'sop', 'bakso', 'mie', 'gado', 'rendang', 'soto'
+    ],
+    'Shopping & Retail': [
+        'mart', 'market', 'grocery', 'supermarket', 'indomaret',
+        'alfamart', 'shop', 'store', 'mall', 'plaza', 'hypermart',
+        'carrefour', 'giant', 'lottemart', 'ranch', 'hero', 'ace',
+        'electronic', 'gramedia', 'periplus', 'uniqlo', 'zara', 'h&m'
+    ],
+    'Transportation': [
+        'shell', 'pertamina', 'spbu', 'gas', 'petrol', 'bensin',
+        'grab', 'gojek', 'blue bird', 'silver bird', 'taxi',
+        'parkir', 'parking', 'tol', 'toll', 'busway', 'transjakarta'
+    ],
+    'Health & Medical': [
+        'apotek', 'pharmacy', 'clinic', 'hospital', 'dokter', 'rs ',
+        'rumah sakit', 'kimia farma', 'guardian', 'century',
+        'klinik', 'medical', 'kesehatan', 'lab', 'laboratorium'
+    ],
+    'Personal Care & Beauty': [
+        'salon', 'barbershop', 'spa', 'massage', 'pijet', 'reflexi',
+        'nail', 'facial', 'watsons', 'guardian', 'kosmetik', 'parfum',
+        'kecantikan', 'perawatan', 'potong rambut', 'hair'
+    ],
+    'Utilities & Bills': [
+        'pln', 'listrik', 'telkom', 'internet', 'water', 'air',
+        'indihome', 'xl', 'telkomsel', 'indosat', 'tri', 'smartfren',
+        'pulsa', 'token', 'pdam', 'wifi', 'bayar', 'tagihan'
+    ],
+    'Entertainment & Recreation': [
+        'cinema', 'bioskop', 'xxi', 'cgv', 'karaoke', 'gym', 'fitness',
+        'netflix', 'spotify', 'game', 'playstation', 'billiard',
+        'bowling', 'timezone', 'amazone', 'waterboom', 'ancol'
+    ],
+    'Education & Learning': [
+        'sekolah', 'university', 'universitas', 'kampus', 'course',
+        'kursus', 'les', 'bimbel', 'training', 'seminar', 'workshop',
+        'gramedia', 'toko buku', 'bookstore', 'perpustakaan'
+    ],
+    'Housing & Rent': [
+        'kost', 'rental', 'sewa', 'apartment', 'apartemen', 'hotel',
+        'penginapan', 'villa', 'airbnb', 'oyo', 'reddoorz', 'airy'
+    ],
+}
+
+_MERCHANT_CATEGORIES = list(MERCHANT_CATEGORY_KEYWORDS)
+_MERCHANT_KEYWORD_RANKS = {}
+for _rank, _keywords in enumerate(MERCHANT_CATEGORY_KEYWORDS.values()):
+    for _keyword in _keywords:
+        _MERCHANT_KEYWORD_RANKS.setdefault(_keyword, _rank)
+_MERCHANT_AUTOMATON = build_keyword_automaton(_MERCHANT_KEYWORD_RANKS)
+# Without pyahocorasick: one alternation per category, tried in priority order
+_MERCHANT_PATTERNS = {
+    category: re.compile('|'.join(map(re.escape, keywords)))
+    for category, keywords in MERCHANT_CATEGORY_KEYWORDS.items()
+}
+
+# Keep the gRPC connection alive between receipts so uploads skip a fresh TLS handshake.
+# The unlimited message sizes match the generated transport's defaults; album batches of
+# DOCUMENT_TEXT_DETECTION responses can exceed gRPC's 4 MB receive limit.
+VISION_CHANNEL_OPTIONS = [
+    ('grpc.max_send_message_length', -1),
+    ('grpc.max_receive_message_length', -1),
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+]
+
+def _log_vision_retry(error):
+    print(f"⚠️ Vision API busy, retrying: {error}")
+
+# Back off on quota and transient errors instead of failing the receipt
+VISION_RETRY = api_retry.Retry(
+    predicate=api_retry.if_exception_type(
+        api_exceptions.ResourceExhausted,
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.DeadlineExceeded,
+    ),
+    initial=1.0,
+    maximum=30.0,
+    multiplier=2.0,
+    deadline=60.0,
+    on_error=_log_vision_retry,
+)
+
+# Parsed receipts keyed by image hash, so re-sent/forwarded photos skip Vision and Gemini
+RECEIPT_CACHE_SIZE = 256
+# OCR text keyed by image hash alone, so re-parsing a photo (e.g. after a regex fallback) skips Vision
+OCR_CACHE_SIZE = 256
+REGEX_SOURCE = 'Vision API (regex)'
+
+# One Vision client (and channel) per process, shared by every VisionProcessor
+_VISION_CLIENT = None
+
+def _get_vision_client():
+    """Create the shared Vision client on first use"""
+    global _VISION_CLIENT
+    if _VISION_CLIENT is None:
+        credentials = Credentials.from_service_account_file(GOOGLE_CREDENTIALS_FILE)
+        channel = ImageAnnotatorGrpcTransport.create_channel(
+            credentials=credentials,
+            options=VISION_CHANNEL_OPTIONS
+        )
+        _VISION_CLIENT = vision.ImageAnnotatorClient(
+            transport=ImageAnnotatorGrpcTransport(channel=channel)
+        )
+    return _VISION_CLIENT
+
+# Receipt prompt; filled with str.format, so literal braces are doubled
+_RECEIPT_PROMPT_TEMPLATE = """
+    Analyze this Indonesian receipt OCR text and extract the correct information:
+
+    OCR TEXT:
+    {ocr_text}
+
+    PARSING RULES:
+    1. MERCHANT: Find the business/store name (usually at the top, ignore address/phone)
+    2. TOTAL AMOUNT: Find the final amount paid (look for "TOTAL", "JUMLAH", "GRAND TOTAL", or largest amount at bottom)
+    3. DATE: Extract transaction date (DD/MM/YYYY, DD-MM-YYYY, or "DD Month YYYY" format)
+    4. IGNORE: Phone numbers, reference codes, item codes, tax IDs
+    5. CATEGORY: Classify based on merchant type
+
+    Return ONLY valid JSON:
+    {{
+    "merchant": "Business Name",
+    "amount": numeric_amount_only,
+    "date": "YYYY-MM-DD",
+    "category": "one of: {categories}"
+    }}
+
+    IMPORTANT: The category MUST be exactly one of these options: {categories}
+
+    EXAMPLES:
+    - "TOTAL: 25,200" → amount: 25200
+    - "ALFAMART CILANDAK" → merchant: "Alfamart Cilandak"
+    - "18-03-2022" → date: "2022-03-18"
+    - "BreadTalk" → category: "Food & Dining"
+
+    Focus on accuracy. If unsure about any field, use reasonable defaults.
+    """
+
+def _prepare_image(image_bytes):
+    """Downscale oversized photos and re-encode as JPEG; anything else is sent unchanged"""
+    try:
+        with Image.open(BytesIO(image_bytes)) as img:
+            if max(img.size) <= MAX_IMAGE_EDGE:
+                return image_bytes
+            # Re-encoding drops EXIF, so bake the camera orientation into the pixels first
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+            buffer = BytesIO()
+            img.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+            print(f"🖼️ Receipt image downscaled: {len(image_bytes)} → {buffer.tell()} bytes")
+            return buffer.getvalue()
+    except OSError:
+        # Not an image Pillow can read; let Vision decide
+        return image_bytes
+
+def _receipt_response_schema(categories):
+    """Gemini response schema for a parsed receipt, with category limited to the sheet's list"""
+    return {
+        'type': 'object',
+        'properties': {
+            'merchant': {'type': 'string'},
+            'amount': {'type': 'number'},
+            'date': {'type': 'string', 'nullable': True},
+            'category': {'type': 'string', 'format': 'enum', 'enum': list(categories)},
+        },
+        'required': ['merchant', 'amount', 'category'],
+    }
 
 class VisionProcessor:
     def __init__(self,  sheets_manager=None):
 
         # Store sheets_manager reference
         self.sheets_manager = sheets_manager
+        self._receipt_cache = LRUCache(RECEIPT_CACHE_SIZE)
+        self._ocr_cache = LRUCache(OCR_CACHE_SIZE)
 
         """Initialize Google Vision API and Gemini AI clients"""
         # Initialize Vision API
         try:
-            credentials = Credentials.from_service_account_file(GOOGLE_CREDENTIALS_FILE)
-            self.vision_client = vision.ImageAnnotatorClient(credentials=credentials)
+            self.vision_client = _get_vision_client()
             print("✅ Google Vision API initialized")
         except Exception as e:
             print(f"❌ Vision API initialization failed: {e}")
@@ -37,93 +246,174 @@ class VisionProcessor:
             print(f"❌ Gemini AI initialization failed: {e}")
             self.gemini_model = None
 
-    def extract_receipt_data(self, image_path, message_date, user_name):
+    def extract_receipt_data(self, image_bytes, message_date, user_name):
         """Extract and parse receipt data using Vision API + Gemini AI"""
         if not self.vision_client:
             return {'error': 'Vision API not available'}
         
+        message_day = self._message_day(message_date)
+        image_hash = self._image_hash(image_bytes)
+        cache_key = (image_hash, message_day)
+        cached = self._receipt_cache.get(cache_key)
+        if cached is not None:
+            cached['input_by'] = user_name
+            return cached
+        
         try:
-            # Extract text using Vision API
-            with open(image_path, 'rb') as image_file:
-                content = image_file.read()
-            
-            image = vision.Image(content=content)
-            response = self.vision_client.document_text_detection(image=image)
-            
-            if response.error.message:
-                raise Exception(f'Vision API error: {response.error.message}')
-            
-            raw_text = response.full_text_annotation.text if response.full_text_annotation else ""
-            
-            if not raw_text.strip():
-                return {'error': 'No text found in receipt'}
-            
-            # Parse with Gemini AI (preferred method)
-            if self.gemini_model:
-                receipt_data = self._parse_with_gemini(raw_text, message_date, user_name)
-                if not receipt_data.get('error'):
-                    return receipt_data
-            
-            # Fallback to regex parsing
-            return self._parse_with_regex(raw_text, message_date, user_name)
+            raw_text = self._cached_ocr_text(image_hash)
+            if raw_text is None:
+                # Extract text using Vision API
+                image = vision.Image(content=_prepare_image(image_bytes))
+                response = self.vision_client.document_text_detection(image=image, retry=VISION_RETRY)
+                raw_text = self._annotation_text(response, image_hash)
+            receipt_data = self._parse_text(raw_text, message_day, user_name)
+            self._cache_receipt(cache_key, receipt_data)
+            return receipt_data
             
         except Exception as e:
             print(f"❌ Receipt processing error: {e}")
             return {'error': f'Failed to process receipt: {str(e)}'}
 
-    def _parse_with_gemini(self, ocr_text, message_date, user_name):
-        """Use Gemini AI to intelligently parse receipt OCR text"""
-        try:
-            # ✅ GET DYNAMIC CATEGORIES
-            available_categories = self._get_available_categories()
-            categories_str = "|".join(available_categories)
+    def extract_receipt_data_batch(self, images, message_dates, user_names):
+        """Extract several receipts with one batch_annotate_images call per VISION_BATCH_SIZE images"""
+        if not self.vision_client:
+            return [{'error': 'Vision API not available'} for _ in images]
+        
+        results = [None] * len(images)
+        message_days = [self._message_day(message_date) for message_date in message_dates]
+        image_hashes = [self._image_hash(image_bytes) for image_bytes in images]
+        cache_keys = list(zip(image_hashes, message_days))
+        
+        # Serve cached receipts directly and re-parse cached OCR text; only the rest go to Vision
+        pending = []
+        for index, cache_key in enumerate(cache_keys):
+            cached = self._receipt_cache.get(cache_key)
+            if cached is not None:
+                cached['input_by'] = user_names[index]
+                results[index] = cached
+                continue
             
-            prompt = f"""
-    Analyze this Indonesian receipt OCR text and extract the correct information:
+            raw_text = self._cached_ocr_text(image_hashes[index])
+            if raw_text is None:
+                pending.append(index)
+                continue
+            
+            try:
+                receipt_data = self._parse_text(raw_text, message_days[index], user_names[index])
+                self._cache_receipt(cache_key, receipt_data)
+                results[index] = receipt_data
+            except Exception as e:
+                print(f"❌ Receipt processing error: {e}")
+                results[index] = {'error': f'Failed to process receipt: {str(e)}'}
+        
+        for start in range(0, len(pending), VISION_BATCH_SIZE):
+            chunk = pending[start:start + VISION_BATCH_SIZE]
+            requests = [
+                vision.AnnotateImageRequest(
+                    image=vision.Image(content=_prepare_image(images[index])),
+                    features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)]
+                )
+                for index in chunk
+            ]
+            
+            try:
+                batch_response = self.vision_client.batch_annotate_images(requests=requests, retry=VISION_RETRY)
+            except Exception as e:
+                print(f"❌ Receipt batch processing error: {e}")
+                for index in chunk:
+                    results[index] = {'error': f'Failed to process receipt: {str(e)}'}
+                continue
+            
+            for index, response in zip(chunk, batch_response.responses):
+                try:
+                    raw_text = self._annotation_text(response, image_hashes[index])
+                    receipt_data = self._parse_text(raw_text, message_days[index], user_names[index])
+                    self._cache_receipt(cache_keys[index], receipt_data)
+                    results[index] = receipt_data
+                except Exception as e:
+                    print(f"❌ Receipt processing error: {e}")
+                    results[index] = {'error': f'Failed to process receipt: {str(e)}'}
+        
+        return results
 
-    OCR TEXT:
-    {ocr_text}
+    def _cache_receipt(self, cache_key, receipt_data):
+        """Cache Gemini and fast-path parses only"""
+        # A regex fallback usually means Gemini failed transiently; a re-send should retry it
+        if receipt_data.get('error') or receipt_data.get('source') == REGEX_SOURCE:
+            return
+        self._receipt_cache.put(cache_key, receipt_data)
 
-    PARSING RULES:
-    1. MERCHANT: Find the business/store name (usually at the top, ignore address/phone)
-    2. TOTAL AMOUNT: Find the final amount paid (look for "TOTAL", "JUMLAH", "GRAND TOTAL", or largest amount at bottom)
-    3. DATE: Extract transaction date (DD/MM/YYYY, DD-MM-YYYY, or "DD Month YYYY" format)
-    4. IGNORE: Phone numbers, reference codes, item codes, tax IDs
-    5. CATEGORY: Classify based on merchant type
+    def _message_day(self, message_date):
+        """Message date as YYYY-MM-DD, the transaction date for undated receipts"""
+        return self._normalize_datetime(message_date).strftime('%Y-%m-%d')
 
-    Return ONLY valid JSON:
-    {{
-    "merchant": "Business Name",
-    "amount": numeric_amount_only,
-    "date": "YYYY-MM-DD",
-    "category": "one of: {categories_str}"
-    }}
+    def _image_hash(self, image_bytes):
+        """OCR cache key; receipt cache keys add the message day, since undated receipts fall back to it"""
+        return hashlib.sha256(image_bytes).hexdigest()
 
-    IMPORTANT: The category MUST be exactly one of these options: {categories_str}
+    def _cached_ocr_text(self, image_hash):
+        """OCR text from an earlier Vision call on the same image, or None"""
+        cached = self._ocr_cache.get(image_hash)
+        return cached['raw_text'] if cached is not None else None
 
-    EXAMPLES:
-    - "TOTAL: 25,200" → amount: 25200
-    - "ALFAMART CILANDAK" → merchant: "Alfamart Cilandak"
-    - "18-03-2022" → date: "2022-03-18"
-    - "BreadTalk" → category: "Food & Dining"
+    def _annotation_text(self, response, image_hash):
+        """Full text of one Vision text-detection response, cached whatever the parse outcome"""
+        if response.error.code:
+            raise Exception(f'Vision API error: {response.error.message}')
+        
+        raw_text = response.full_text_annotation.text if response.full_text_annotation else ""
+        self._ocr_cache.put(image_hash, {'raw_text': raw_text})
+        return raw_text
 
-    Focus on accuracy. If unsure about any field, use reasonable defaults.
-    """
+    def _parse_text(self, raw_text, message_day, user_name):
+        """Turn receipt OCR text into receipt data"""
+        # Split and lowercase once for the local parsers
+        lines = [stripped for line in raw_text.splitlines() if (stripped := line.strip())]
+        if not lines:
+            return {'error': 'No text found in receipt'}
+        lines_lower = [line.lower() for line in lines]
+        
+        # Unambiguous chain-store receipts skip the Gemini round trip
+        receipt_data = self._try_fast_parse(raw_text, lines, lines_lower, message_day, user_name)
+        if receipt_data:
+            return receipt_data
+        
+        # Parse with Gemini AI (preferred method)
+        if self.gemini_model:
+            receipt_data = self._parse_with_gemini(raw_text, message_day, user_name)
+            if not receipt_data.get('error'):
+                return receipt_data
+        
+        # Fallback to regex parsing
+        return self._parse_with_regex(lines, lines_lower, message_day, user_name)
+
+    def _parse_with_gemini(self, ocr_text, message_day, user_name):
+        """Use Gemini AI to intelligently parse receipt OCR text"""
+        try:
+            # ✅ GET DYNAMIC CATEGORIES
+            available_categories = self._get_available_categories()
+            categories_str = "|".join(available_categories)
+            
+            prompt = _RECEIPT_PROMPT_TEMPLATE.format(ocr_text=ocr_text, categories=categories_str)
 
-            response = self.gemini_model.generate_content(prompt)
+            # JSON mode with the category enum, so replies parse on the first try
+            response = self.gemini_model.generate_content(
+                prompt,
+                generation_config={
+                    'response_mime_type': 'application/json',
+                    'response_schema': _receipt_response_schema(available_categories),
+                }
+            )
             
             # Extract JSON from response
-            json_match = re.search(r'\{[^}]*\}', response.text, re.DOTALL)
-            if not json_match:
+            ai_result = TextUtils.extract_json_object(response.text)
+            if ai_result is None:
                 return {'error': 'No valid JSON in AI response'}
-
-            ai_result = json.loads(json_match.group())
             
             # ✅ VALIDATE CATEGORY against available categories
             category = ai_result.get('category', 'Others')
             if category not in available_categories:
                 # Use CategoryUtils for fallback categorization
-                from utils import CategoryUtils
                 category = CategoryUtils.match_category_by_keywords(
                     ocr_text, ai_result.get('merchant', ''), available_categories
                 )
@@ -134,7 +424,7 @@ class VisionProcessor:
                 'amount': self._clean_amount(ai_result.get('amount', 0)),
                 'location': ai_result.get('merchant', 'Unknown'),
                 'category': category,  # ✅ USE VALIDATED CATEGORY
-                'transaction_date': ai_result.get('date') or self._normalize_datetime(message_date).strftime('%Y-%m-%d'),
+                'transaction_date': ai_result.get('date') or message_day,
                 'input_by': user_name,
                 'source': 'Vision API + Gemini AI'
             }
@@ -145,39 +435,83 @@ class VisionProcessor:
             
             return receipt_data
 
-        except json.JSONDecodeError as e:
-            return {'error': 'Invalid AI response format'}
         except Exception as e:
             return {'error': f'AI parsing failed: {str(e)}'}
 
 
-    def _parse_with_regex(self, raw_text, message_date, user_name):
+    def _try_fast_parse(self, ocr_text, lines, lines_lower, message_day, user_name):
+        """Parse a known chain-store receipt locally; None if merchant, total or date is ambiguous"""
+        merchant = None
+        for line_lower in lines_lower[:3]:
+            for keyword, name in KNOWN_RECEIPT_MERCHANTS.items():
+                if keyword in line_lower:
+                    merchant = name
+                    break
+            if merchant:
+                break
+        if not merchant:
+            return None
+        
+        totals = set()
+        for line, line_lower in zip(lines, lines_lower):
+            if _TOTAL_LINE_RE.search(line_lower):
+                for num in _NUMBER_RE.findall(line):
+                    amount = self._parse_indonesian_number(num)
+                    if amount and amount >= 1000:
+                        totals.add(amount)
+        if len(totals) != 1:
+            return None
+        
+        # Receipts can't be dated after the photo was sent; such hits are times, not dates
+        dates = set()
+        for day, month, year in _RECEIPT_DATE_RE.findall(ocr_text):
+            try:
+                year = int(year) + 2000 if len(year) == 2 else int(year)
+                date_str = datetime(year, int(month), int(day)).strftime('%Y-%m-%d')
+            except ValueError:
+                continue
+            if date_str <= message_day:
+                dates.add(date_str)
+        if len(dates) != 1:
+            return None
+        
+        return {
+            'description': f"Purchase at {merchant}".capitalize(),
+            'amount': totals.pop(),
+            'location': merchant,
+            'category': CategoryUtils.match_category_by_keywords(
+                merchant, merchant, self._get_available_categories()
+            ),
+            'transaction_date': dates.pop(),
+            'input_by': user_name,
+            'source': 'Vision API (fast path)'
+        }
+
+    def _parse_with_regex(self, lines, lines_lower, message_day, user_name):
         """Fallback regex-based parsing"""
         receipt_data = {
             'description': 'Receipt purchase',
             'amount': 0,
             'location': 'Unknown',
             'category': 'Other',
-            'transaction_date': self._normalize_datetime(message_date).strftime('%Y-%m-%d'),
+            'transaction_date': message_day,
             'input_by': user_name,
-            'source': 'Vision API (regex)'
+            'source': REGEX_SOURCE
         }
         
-        lines = [line.strip() for line in raw_text.split('\n') if line.strip()]
-        
         # Extract merchant (first meaningful line)
-        for line in lines[:5]:
+        for line, line_lower in zip(lines[:5], lines_lower):
             if (len(line) > 3 and 
-                not re.match(r'^[\d\s\-/:.,]+$', line) and
-                not any(skip in line.lower() for skip in ['receipt', 'struk', 'bon', 'total'])):
+                not _NUMERIC_LINE_RE.match(line) and
+                not _HEADER_SKIP_RE.search(line_lower)):
                 receipt_data['location'] = line.title()
                 break
         
         # Extract amount (prioritize lines with total keywords)
         amounts = []
-        for line in lines:
-            if any(keyword in line.lower() for keyword in ['total', 'jumlah', 'grand total']):
-                numbers = re.findall(r'\d{1,3}(?:[.,]\d{3})*', line)
+        for line, line_lower in zip(lines, lines_lower):
+            if _TOTAL_LINE_RE.search(line_lower):
+                numbers = _NUMBER_RE.findall(line)
                 for num in numbers:
                     amount = self._parse_indonesian_number(num)
                     if amount and amount >= 1000:
@@ -187,7 +521,7 @@ class VisionProcessor:
         if not amounts:
             bottom_lines = lines[-5:] if len(lines) > 5 else lines
             for line in bottom_lines:
-                numbers = re.findall(r'\d{1,3}(?:[.,]\d{3})*', line)
+                numbers = _NUMBER_RE.findall(line)
                 for num in numbers:
                     amount = self._parse_indonesian_number(num)
                     if amount and 1000 <= amount <= 10000000:
@@ -209,7 +543,7 @@ class VisionProcessor:
     def _parse_indonesian_number(self, number_str):
         """Parse Indonesian number format"""
         try:
-            clean_number = re.sub(r'[.,]', '', str(number_str))
+            clean_number = str(number_str).translate(THOUSANDS_SEP_TABLE)
             return float(clean_number)
         except (ValueError, TypeError):
             return None
@@ -219,90 +553,19 @@ class VisionProcessor:
         if self.sheets_manager:
             # Use dynamic categories from Google Sheet
             available_categories = self._get_available_categories()
-            from utils import CategoryUtils
             return CategoryUtils.match_category_by_keywords(
                 merchant_name, merchant_name, available_categories
             )
         else:
-            # Fallback to hardcoded logic if no sheets manager
+            # Fallback to hardcoded keywords if no sheets manager
             merchant_lower = merchant_name.lower()
-            
-            # Food & Dining
-            if any(word in merchant_lower for word in [
-                'restaurant', 'resto', 'cafe', 'food', 'makan', 'warung',
-                'kfc', 'mcd', 'pizza', 'bakery', 'bread', 'cake', 'starbucks',
-                'dunkin', 'breadtalk', 'hokben', 'ayam', 'sate', 'nasi', 'warteg',
-                'padang', 'sop', 'bakso', 'mie', 'gado', 'rendang', 'soto'
-            ]):
-                return 'Food & Dining'
-            
-            # Shopping & Retail  
-            elif any(word in merchant_lower for word in [
-                'mart', 'market', 'grocery', 'supermarket', 'indomaret',
-                'alfamart', 'shop', 'store', 'mall', 'plaza', 'hypermart',
-                'carrefour', 'giant', 'lottemart', 'ranch', 'hero', 'ace',
-                'electronic', 'gramedia', 'periplus', 'uniqlo', 'zara', 'h&m'
-            ]):
-                return 'Shopping & Retail'
-            
-            # Transportation
-            elif any(word in merchant_lower for word in [
-                'shell', 'pertamina', 'spbu', 'gas', 'petrol', 'bensin',
-                'grab', 'gojek', 'blue bird', 'silver bird', 'taxi',
-                'parkir', 'parking', 'tol', 'toll', 'busway', 'transjakarta'
-            ]):
-                return 'Transportation'
-            
-            # Health & Medical
-            elif any(word in merchant_lower for word in [
-                'apotek', 'pharmacy', 'clinic', 'hospital', 'dokter', 'rs ',
-                'rumah sakit', 'kimia farma', 'guardian', 'century',
-                'klinik', 'medical', 'kesehatan', 'lab', 'laboratorium'
-            ]):
-                return 'Health & Medical'
-            
-            # Personal Care & Beauty
-            elif any(word in merchant_lower for word in [
-                'salon', 'barbershop', 'spa', 'massage', 'pijet', 'reflexi',
-                'nail', 'facial', 'watsons', 'guardian', 'kosmetik', 'parfum',
-                'kecantikan', 'perawatan', 'potong rambut', 'hair'
-            ]):
-                return 'Personal Care & Beauty'
-            
-            # Utilities & Bills
-            elif any(word in merchant_lower for word in [
-                'pln', 'listrik', 'telkom', 'internet', 'water', 'air',
-                'indihome', 'xl', 'telkomsel', 'indosat', 'tri', 'smartfren',
-                'pulsa', 'token', 'pdam', 'wifi', 'bayar', 'tagihan'
-            ]):
-                return 'Utilities & Bills'
-            
-            # Entertainment & Recreation
-            elif any(word in merchant_lower for word in [
-                'cinema', 'bioskop', 'xxi', 'cgv', 'karaoke', 'gym', 'fitness',
-                'netflix', 'spotify', 'game', 'playstation', 'billiard',
-                'bowling', 'timezone', 'amazone', 'waterboom', 'ancol'
-            ]):
-                return 'Entertainment & Recreation'
-            
-            # Education & Learning
-            elif any(word in merchant_lower for word in [
-                'sekolah', 'university', 'universitas', 'kampus', 'course',
-                'kursus', 'les', 'bimbel', 'training', 'seminar', 'workshop',
-                'gramedia', 'toko buku', 'bookstore', 'perpustakaan'
-            ]):
-                return 'Education & Learning'
-            
-            # Housing & Rent
-            elif any(word in merchant_lower for word in [
-                'kost', 'rental', 'sewa', 'apartment', 'apartemen', 'hotel',
-                'penginapan', 'villa', 'airbnb', 'oyo', 'reddoorz', 'airy'
-            ]):
-                return 'Housing & Rent'
-            
-            # Default fallback
-            else:
-                return 'Others'
+            if _MERCHANT_AUTOMATON is not None:
+                ranks = [rank for _, (_, rank) in _MERCHANT_AUTOMATON.iter(merchant_lower)]
+                return _MERCHANT_CATEGORIES[min(ranks)] if ranks else 'Others'
+            for category, pattern in _MERCHANT_PATTERNS.items():
+                if pattern.search(merchant_lower):
+                    return category
+            return 'Others'
 
     def _normalize_datetime(self, dt):
         """Convert datetime to timezone-naive for consistent operations"""
@@ -320,6 +583,4 @@ class VisionProcessor:
             return self.sheets_manager.get_categories()
         else:
             # Fallback categories if no sheets manager available
-            return ['Food & Dining', 'Transportation', 'Shopping & Retail', 'Utilities & Bills',
-                    'Health & Medical', 'Entertainment & Recreation', 'Education & Learning',
-                    'Personal Care & Beauty', 'Housing & Rent', 'Others']
+            return DEFAULT_CATEGORIES